@@ -0,0 +1,161 @@
+# build_index.py
+import os
+import json
+import numpy as np
+import faiss
+import mysql.connector
+from db import get_connection
+
+# This script loads product embeddings from the database, builds the Faiss index, and saves both to disk.
+# The search server memory-maps these files on startup instead of re-reading every BLOB from MySQL,
+# so forked workers also share the same physical pages.
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index_cache'))
+INDEX_FILE = os.path.join(INDEX_DIR, 'index.faiss')
+IDS_FILE = os.path.join(INDEX_DIR, 'ids.npy')
+CATEGORIES_FILE = os.path.join(INDEX_DIR, 'cats.npy')
+EMBEDDINGS_FILE = os.path.join(INDEX_DIR, 'embeddings.npy')
+NAMES_FILE = os.path.join(INDEX_DIR, 'names.json')
+
+# Stored in cats.npy for products without a category
+NO_CATEGORY = -1
+
+# HNSW index parameters: graph neighbors per node, and candidate list sizes when building and searching
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 64
+
+# Fetches the products with embeddings and returns (product_ids, category_ids, names, embeddings),
+# all aligned so that row i of every array describes the same product.
+def load_products_from_db():
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        # Fetch category_id along with other product data. Sorting by category keeps each category's
+        # products contiguous, so category-scoped search can score a slice of the embeddings without copying.
+        # MySQL sorts NULL categories first, matching NO_CATEGORY = -1.
+        cursor.execute(
+            "SELECT product_id, product_name, product_embedding, category_id FROM products "
+            "WHERE product_embedding IS NOT NULL ORDER BY category_id, product_id"
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+    product_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    names = [row[1] or '' for row in rows]
+    category_ids = np.fromiter((NO_CATEGORY if row[3] is None else row[3] for row in rows), dtype=np.int64, count=len(rows))
+    # Concatenate the BLOBs once and view them as a single (N, d) matrix without per-row copies.
+    # A bytearray is used so the resulting matrix stays writable.
+    raw_embeddings = bytearray().join(row[2] for row in rows)
+    if rows:
+        embeddings = np.frombuffer(raw_embeddings, dtype=np.float32).reshape(len(rows), -1)
+    else:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+    return product_ids, category_ids, names, embeddings
+
+# Builds the Faiss index over the embeddings, normalizing them in place first
+def build_faiss_index(embeddings):
+    dimension = embeddings.shape[1]  # Dimension of embeddings
+    faiss.normalize_L2(embeddings)  # Normalize in place so inner product equals cosine similarity
+    # HNSW graph index so search is sublinear instead of scanning every vector. The vectors are stored with
+    # 8-bit scalar quantization, which is 4x smaller than float32 and uses SIMD int8 inner-product kernels.
+    index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)  # Learn the per-dimension quantization ranges
+    index.add(embeddings)  # Add all product embeddings to the index
+    index.hnsw.efSearch = HNSW_EF_SEARCH  # Faiss uses max(efSearch, K) at query time
+    return index
+
+# Writes each file under a temporary name first so a running server never maps a half-written file
+def save_index_cache(index, product_ids, category_ids, names, embeddings):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    faiss.write_index(index, INDEX_FILE + '.tmp')
+    os.replace(INDEX_FILE + '.tmp', INDEX_FILE)
+    for path, array in ((IDS_FILE, product_ids), (CATEGORIES_FILE, category_ids), (EMBEDDINGS_FILE, embeddings)):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+    with open(NAMES_FILE + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(names, f)
+    os.replace(NAMES_FILE + '.tmp', NAMES_FILE)
+
+# Memory-maps the cached index and arrays. Returns (index, product_ids, category_ids, names, embeddings).
+def load_index_cache():
+    # IO_FLAG_MMAP only applies to IVF inverted lists; IO_FLAG_MMAP_IFC also maps the HNSW index's SQ codes
+    index = faiss.read_index(INDEX_FILE, faiss.IO_FLAG_MMAP_IFC)
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    product_ids = np.load(IDS_FILE, mmap_mode='r')
+    category_ids = np.load(CATEGORIES_FILE, mmap_mode='r')
+    embeddings = np.load(EMBEDDINGS_FILE, mmap_mode='r')
+    with open(NAMES_FILE, encoding='utf-8') as f:
+        names = json.load(f)
+    return index, product_ids, category_ids, names, embeddings
+
+# The cache files are replaced one at a time, so a crash while saving can leave them out of step.
+# Checks that every file describes the same products, sorted by category as load_products_from_db() returns them.
+def is_index_cache_consistent(index, product_ids, category_ids, names, embeddings):
+    num_products = len(product_ids)
+    if not (index.ntotal == num_products == len(category_ids) == len(names) == len(embeddings)):
+        return False
+    return bool(np.all(category_ids[1:] >= category_ids[:-1]))
+
+# The cache is stale if it is missing or the products table changed after it was written.
+# MySQL may report a NULL UPDATE_TIME (e.g. after a restart), in which case the existing cache is trusted.
+def is_index_cache_stale():
+    cache_files = (INDEX_FILE, IDS_FILE, CATEGORIES_FILE, EMBEDDINGS_FILE, NAMES_FILE)
+    if not all(os.path.exists(path) for path in cache_files):
+        return True
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        try:
+            # MySQL 8 caches table statistics (including UPDATE_TIME) for up to a day by default
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except mysql.connector.Error:
+            pass # Older MySQL/MariaDB servers don't cache these statistics
+        # Compare as Unix timestamps so the DB server's and this host's time zones don't matter
+        cursor.execute(
+            "SELECT UNIX_TIMESTAMP(UPDATE_TIME) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = 'products'"
+        )
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
+
+    if row is None or row[0] is None:
+        return False
+    cache_time = min(os.path.getmtime(path) for path in cache_files)
+    return float(row[0]) > cache_time
+
+# Rebuilds the index from the database and saves it. Returns the same tuple as load_index_cache(),
+# with index set to None when there are no product embeddings.
+def build_index():
+    product_ids, category_ids, names, embeddings = load_products_from_db()
+    if embeddings.size == 0:
+        return None, product_ids, category_ids, names, embeddings
+    index = build_faiss_index(embeddings)
+    save_index_cache(index, product_ids, category_ids, names, embeddings)
+    return index, product_ids, category_ids, names, embeddings
+
+# Loads the cached index, rebuilding it first if the products have changed since it was saved
+def load_or_build_index():
+    if is_index_cache_stale():
+        print("Index cache is missing or out of date. Building index from DB...")
+        return build_index()
+    print("Loading index from cache...")
+    cached = load_index_cache()
+    if not is_index_cache_consistent(*cached):
+        print("Index cache files are inconsistent. Rebuilding index from DB...")
+        return build_index()
+    return cached
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    index, product_ids, category_ids, names, embeddings = build_index()
+    if index is None:
+        print("No product embeddings found in the database.")
+    else:
+        print(f"Faiss index built with {index.ntotal} embeddings and saved to '{INDEX_DIR}'.")
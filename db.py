@@ -0,0 +1,35 @@
+# db.py
+import os
+from mysql.connector import pooling
+
+# This module provides pooled MySQL connections shared by the search service and the maintenance scripts.
+POOL_NAME = 'canvasiligan'
+
+# The pool is created on first use so that credentials loaded by load_dotenv() are picked up.
+# Creating the pool opens all of its connections, so it is sized for the caller's actual needs.
+connection_pool = None
+
+# pool_size only applies to the call that creates the pool; it should cover the most connections
+# the process holds open at the same time (scripts that use one connection at a time need just 1)
+def get_connection(pool_size=1):
+    global connection_pool
+    if connection_pool is None:
+        connection_pool = pooling.MySQLConnectionPool(
+            pool_name=POOL_NAME,
+            pool_size=pool_size,
+            host=os.getenv('DB_HOST'),
+            port=os.getenv('DB_PORT'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            database=os.getenv('DB_NAME')
+        )
+    # Closing a pooled connection returns it to the pool instead of disconnecting
+    return connection_pool.get_connection()
+
+# Disconnects the pool's idle connections, e.g. so they aren't inherited by forked worker processes.
+# Connections still checked out are unaffected; a later get_connection() creates a new pool.
+def close_pool():
+    global connection_pool
+    if connection_pool is not None:
+        connection_pool._remove_connections()
+        connection_pool = None
@@ -1,27 +1,75 @@
 import mysql.connector
+from db import get_connection
+from build_index import build_index
 from sentence_transformers import SentenceTransformer
 import numpy as np
-import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of products fetched, encoded, and stored per batch. Streaming in batches keeps memory
+# bounded for large catalogs instead of materializing every product row up front.
+BATCH_SIZE = 2000
+
+# The model only sees its first 256 tokens anyway, so long descriptions are cut at the character level
+# before tokenizing. Shorter texts also mean less padding in each encoding batch.
+MAX_DESCRIPTION_CHARS = 400
+
+# executemany() only rewrites INSERT ... VALUES into a single multi-row statement (an UPDATE would still be
+# sent once per row), so each batch is inserted into this staging table and applied with one joined UPDATE.
+STAGING_TABLE = 'product_embeddings_staging'
+
+# Encodes one batch of products and writes their embeddings back to the database.
+def encode_and_store(model, products, cursor):
+    # --- ENRICHMENT STEP 2: Create a richer text for embedding ---
+    # We now include the category name for more context
+    texts = []
+    for product in products:
+        description = f"{product['product_desc1']} {product['product_desc2']} {product['product_desc3']}"
+        texts.append(
+            f"Category: {product.get('category_name', '')}. "
+            f"Name: {product['product_name']}. "
+            f"Description: {description[:MAX_DESCRIPTION_CHARS]}"
+        )
+    ids = [product['product_id'] for product in products]
+    # -------------------------------------------------------------
+
+    # Generate the batch's embeddings in a single call, which lets the model sort the texts by length
+    # and pad each sub-batch only as much as needed. The vectors are L2-normalized so that
+    # cosine similarity downstream reduces to a plain dot product.
+    embeddings = model.encode(
+        texts,
+        batch_size=64,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=True
+    )
+
+    # Convert each embedding to a byte array for storing in the BLOB column
+    rows = [(product_id, embedding.astype(np.float32).tobytes()) for product_id, embedding in zip(ids, embeddings)]
+
+    # Stage the batch with one multi-row INSERT, then update the product records with a single joined UPDATE.
+    # Every product is overwritten here, so old embeddings don't need clearing first.
+    cursor.executemany(
+        f"INSERT INTO {STAGING_TABLE} (product_id, emb) VALUES (%s, %s)",
+        rows
+    )
+    cursor.execute(
+        f"UPDATE products p JOIN {STAGING_TABLE} t USING (product_id) SET p.product_embedding = t.emb"
+    )
+    cursor.execute(f"DELETE FROM {STAGING_TABLE}")
 
 # This script connects to the database, generates embeddings for products, and stores them in the database.
 def generate_embeddings(model=None):
     try:
-        # Connect to the database
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
-        )
-        cursor = connection.cursor(dictionary=True)
-
-        # --- ENRICHMENT STEP 1: Clear old embeddings to ensure regeneration ---
-        print("Clearing all existing product embeddings...")
-        cursor.execute("UPDATE products SET product_embedding = NULL")
-        connection.commit()
-        print(f"{cursor.rowcount} embeddings cleared.")
-        # --------------------------------------------------------------------
+        # Connect to the database. Rows are streamed from an unbuffered cursor, which keeps its
+        # connection busy until fully read, so updates go through a second connection.
+        # The index cache rebuild at the end needs a third connection while these two are still open.
+        read_connection = get_connection(pool_size=3)
+        write_connection = get_connection()
+        read_cursor = read_connection.cursor(dictionary=True, buffered=False)
+        write_cursor = write_connection.cursor()
+        # Session-scoped staging table for the batched embedding updates
+        write_cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STAGING_TABLE}")
+        write_cursor.execute(f"CREATE TEMPORARY TABLE {STAGING_TABLE} (product_id INT PRIMARY KEY, emb BLOB)")
 
         # Load the pre-trained model if it's not passed as an argument
         if model is None:
@@ -29,7 +77,7 @@ def generate_embeddings(model=None):
             model = SentenceTransformer('all-MiniLM-L6-v2')
             print("Model loaded.")
 
-        # --- ENRICHMENT STEP 2: Fetch products with their category names ---
+        # --- ENRICHMENT STEP 1: Fetch products with their category names ---
         # The query now joins the category table to get the category_name
         query = """
             SELECT
@@ -44,48 +92,51 @@ def generate_embeddings(model=None):
             LEFT JOIN
                 category c ON p.category_id = c.category_id
         """
-        cursor.execute(query)
-        products = cursor.fetchall()
+        read_cursor.execute(query)
 
-        if not products:
+        print("Generating enriched embeddings now...")
+        total_products = 0
+        with ThreadPoolExecutor(max_workers=1) as fetcher:
+            next_batch = fetcher.submit(read_cursor.fetchmany, BATCH_SIZE)
+            while True:
+                products = next_batch.result()
+                if not products:
+                    break
+                # Fetch the next batch from MySQL while this one is being encoded
+                next_batch = fetcher.submit(read_cursor.fetchmany, BATCH_SIZE)
+                encode_and_store(model, products, write_cursor)
+                total_products += len(products)
+                print(f"Processed {total_products} products...")
+
+        if total_products == 0:
             print("No products found in the database.")
             return
 
-        print(f"Found {len(products)} products. Generating enriched embeddings now...")
-
-        for product in products:
-            # --- ENRICHMENT STEP 3: Create a richer text for embedding ---
-            # We now include the category name for more context
-            category_name = product.get('category_name', '') # Use .get for safety
-            text_to_embed = (
-                f"Category: {category_name}. "
-                f"Name: {product['product_name']}. "
-                f"Description: {product['product_desc1']} {product['product_desc2']} {product['product_desc3']}"
-            )
-            # -------------------------------------------------------------
-
-            # Generate the embedding
-            embedding = model.encode(text_to_embed)
-
-            # Convert the embedding to a byte array for storing in the BLOB column
-            embedding_bytes = np.array(embedding).tobytes()
-
-            # Update the product record with the new embedding
-            cursor.execute(
-                "UPDATE products SET product_embedding = %s WHERE product_id = %s",
-                (embedding_bytes, product['product_id'])
-            )
+        write_connection.commit()
+        print(f"Successfully generated and stored enriched embeddings for {total_products} products.")
 
-        connection.commit()
-        print(f"Successfully generated and stored enriched embeddings for {len(products)} products.")
+        # Rebuild the cached search index so the search server loads the new embeddings on its next start
+        print("Rebuilding search index cache...")
+        build_index()
+        print("Search index cache rebuilt.")
 
 
     except mysql.connector.Error as err:
         print(f"Error: {err}")
     finally:
-        if 'connection' in locals() and connection.is_connected():
-            cursor.close()
-            connection.close()
+        if 'write_connection' in locals() and write_connection.is_connected():
+            write_cursor.close()
+            write_connection.close()
+        if 'read_connection' in locals() and read_connection.is_connected():
+            try:
+                # An error mid-stream leaves unread rows on the unbuffered cursor, which must be
+                # discarded before it can be closed without raising over the original error
+                read_connection.consume_results()
+                read_cursor.close()
+            except mysql.connector.Error as err:
+                print(f"Error while closing the product cursor: {err}")
+            finally:
+                read_connection.close()
 
 if __name__ == '__main__':
     from dotenv import load_dotenv
@@ -1,4 +1,7 @@
 # gunicorn.conf.py
+import os
+import sys
+
 # Server socket
 bind = "0.0.0.0:5000"
 
@@ -6,6 +9,12 @@ bind = "0.0.0.0:5000"
 workers = 3
 worker_class = "gevent"
 
+# Split the CPU cores between workers so that 3 workers x all-cores torch/OpenMP threads
+# don't oversubscribe the host during model.encode. These must be set before torch is imported.
+threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+os.environ.setdefault("OMP_NUM_THREADS", str(threads_per_worker))
+os.environ.setdefault("MKL_NUM_THREADS", str(threads_per_worker))
+
 # Preload the application before forking worker processes
 preload_app = True
 
@@ -15,3 +24,18 @@ errorlog = "-"
 
 # Process naming
 # proc_name = "CanvasIligan_Search_Service"
+
+# Server hooks
+def post_fork(server, worker):
+    # Pin torch's thread pools in each worker, since the model is loaded in the master before forking.
+    # Both encoders load torch (optimum imports it as well), so its presence says nothing about which
+    # encoder is active; it just isn't imported here if the app hasn't already loaded it.
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return
+    torch.set_num_threads(threads_per_worker)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before any inter-op parallel work has started in this process
+        pass
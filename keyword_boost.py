@@ -0,0 +1,87 @@
+# keyword_boost.py
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # Without numba the kernel below runs as plain Python, which is slower but gives the same results
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# This module scores keyword matches between the query and product names. Product name words and
+# their stems are stored as integer ids in flat (ragged) arrays so the scoring runs in a JIT-compiled loop.
+
+# Builds the id arrays from each product's lowercased name words.
+# Returns (vocabulary, stem_to_id, word_offsets, word_data, stem_offsets, stem_data), where the ids of
+# product i are data[offsets[i]:offsets[i + 1]] and vocabulary maps a word id back to its string.
+def build_name_token_arrays(product_name_words, stemmer):
+    word_to_id = {}
+    stem_to_id = {}
+    word_stem_ids = [] # Stem id of each word id, so each distinct word is stemmed only once
+    word_offsets = [0]
+    word_data = []
+    stem_offsets = [0]
+    stem_data = []
+    for words in product_name_words:
+        for word in words:
+            if word not in word_to_id:
+                word_to_id[word] = len(word_to_id)
+                word_stem_ids.append(stem_to_id.setdefault(stemmer.stem(word), len(stem_to_id)))
+            word_data.append(word_to_id[word])
+        word_offsets.append(len(word_data))
+        stem_data.extend(sorted({word_stem_ids[word_to_id[word]] for word in words}))
+        stem_offsets.append(len(stem_data))
+    vocabulary = list(word_to_id)
+    return (
+        vocabulary,
+        stem_to_id,
+        np.array(word_offsets, dtype=np.int64),
+        np.array(word_data, dtype=np.int32),
+        np.array(stem_offsets, dtype=np.int64),
+        np.array(stem_data, dtype=np.int32)
+    )
+
+# Returns the sorted ids of vocabulary words that partially match a query word (either contains the other)
+def partial_match_word_ids(query_word, vocabulary):
+    return np.array([word_id for word_id, word in enumerate(vocabulary) if query_word in word or word in query_word], dtype=np.int32)
+
+# Computes the additive keyword boost of every candidate product. For each query word, a stemmed match
+# gives the exact (or generic) boost; otherwise a partial match on any name word gives the partial boost.
+# Query words are given as stem ids (-1 if the stem appears in no product name) and, for partial matches,
+# as ragged sorted arrays of matching word ids.
+@njit(cache=True)
+def compute_boosts(candidates, word_offsets, word_data, stem_offsets, stem_data,
+                   query_stem_ids, query_is_generic, partial_offsets, partial_data,
+                   boost_exact, boost_partial, boost_generic):
+    boosts = np.zeros(len(candidates), dtype=np.float32)
+    for i in range(len(candidates)):
+        product = candidates[i]
+        total_boost = 0.0
+        for q in range(len(query_stem_ids)):
+            # 1. Stemmed Match Boost
+            stem_matched = False
+            if query_stem_ids[q] >= 0:
+                for j in range(stem_offsets[product], stem_offsets[product + 1]):
+                    if stem_data[j] == query_stem_ids[q]:
+                        stem_matched = True
+                        break
+            if stem_matched:
+                if query_is_generic[q]:
+                    total_boost += boost_generic
+                else:
+                    total_boost += boost_exact
+                continue
+
+            # 2. Partial Match Boost (as a fallback)
+            partial_ids = partial_data[partial_offsets[q]:partial_offsets[q + 1]]
+            if len(partial_ids) == 0:
+                continue
+            for j in range(word_offsets[product], word_offsets[product + 1]):
+                k = np.searchsorted(partial_ids, word_data[j])
+                if k < len(partial_ids) and partial_ids[k] == word_data[j]:
+                    total_boost += boost_partial
+                    break
+        boosts[i] = total_boost
+    return boosts
@@ -1,23 +1,18 @@
 import mysql.connector
-from sentence_transformers import SentenceTransformer, util
+from db import get_connection
+from sentence_transformers import SentenceTransformer
 import numpy as np
 import sys
 import json
-import os
 from dotenv import load_dotenv
 
 # This script performs a semantic search on the products in the database.
-def semantic_search(query):
+def semantic_search(query, top_k=50):
     try:
         # Connect to the database
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
-        )
-        cursor = connection.cursor(dictionary=True)
+        connection = get_connection()
+        # Plain tuple rows avoid allocating a dict per product
+        cursor = connection.cursor()
 
         # Load the pre-trained model
         model = SentenceTransformer('all-MiniLM-L6-v2')
@@ -27,26 +22,33 @@ def semantic_search(query):
 
         # Fetch all product embeddings from the database
         cursor.execute("SELECT product_id, product_embedding FROM products WHERE product_embedding IS NOT NULL")
-        products = cursor.fetchall()
+        rows = cursor.fetchall()
 
-        if not products:
+        if not rows:
             print("No products with embeddings found in the database.", file=sys.stderr)
             return []
 
-        product_ids = [product['product_id'] for product in products]
-        product_embeddings = np.array([np.frombuffer(product['product_embedding'], dtype=np.float32) for product in products])
+        product_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        # Concatenate the BLOBs once and view them as a single (N, d) matrix without per-row copies
+        raw_embeddings = b''.join(row[1] for row in rows)
+        product_embeddings = np.frombuffer(raw_embeddings, dtype=np.float32).reshape(len(rows), -1)
 
-        # Calculate cosine similarity between the query embedding and all product embeddings
-        similarities = util.pytorch_cos_sim(query_embedding, product_embeddings)[0]
+        # Product embeddings are stored L2-normalized, so cosine similarity is a single dot product
+        query_vec = query_embedding.astype(np.float32)
+        query_vec /= np.linalg.norm(query_vec)
+        similarities = product_embeddings @ query_vec
 
-        # Create a list of (product_id, similarity) tuples
-        results = zip(product_ids, similarities)
+        # Select the top K matches without fully sorting every product
+        if top_k < len(similarities):
+            top_indices = np.argpartition(-similarities, top_k)[:top_k]
+        else:
+            top_indices = np.arange(len(similarities))
 
-        # Sort the results by similarity in descending order
-        sorted_results = sorted(results, key=lambda x: x[1], reverse=True)
+        # Sort only the selected matches by similarity in descending order
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
 
         # Return the sorted list of product IDs
-        return [int(product_id) for product_id, similarity in sorted_results]
+        return product_ids[top_indices].tolist()
 
     except mysql.connector.Error as err:
         print(f"Error: {err}", file=sys.stderr)
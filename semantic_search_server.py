@@ -1,18 +1,18 @@
 # semantic_search_server.py
-from flask import Flask, request, jsonify
-from sentence_transformers import SentenceTransformer, util
+from flask import Flask, Response, request, jsonify
 import numpy as np
-import mysql.connector
+import orjson
 import json
-import faiss
-import torch
 from nltk.stem import PorterStemmer
-import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from generate_embeddings import generate_embeddings
+from build_index import load_or_build_index
+from db import close_pool
+from keyword_boost import build_name_token_arrays, compute_boosts, partial_match_word_ids
 
 # Define boosting factors for different types of keyword matches
 KEYWORD_BOOST_EXACT = 1.0   # High boost for exact, non-generic word matches
@@ -36,48 +36,110 @@ PROJECT_CATEGORY_ORDER = [
     [5, 12], # Wires and Cables
     [13, 14] # The Rest
 ]
+# Flattened position of each category in PROJECT_CATEGORY_ORDER; unlisted categories rank last and get no preview
+PROJECT_CATEGORY_RANK = {category_id: rank for rank, category_id in enumerate(c for group in PROJECT_CATEGORY_ORDER for c in group)}
+UNLISTED_CATEGORY_RANK = len(PROJECT_CATEGORY_RANK)
 
 app = Flask(__name__)
 stemmer = PorterStemmer() # Initialize the stemmer
 
 # --- LOAD ONCE AT STARTUP ---
 print("Loading model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Model loaded.")
-
-# Automatically generate embeddings for any products that are missing them
-# generate_embeddings(model=model)
-
-print("Loading product data from DB...")
-connection = mysql.connector.connect(
-    host=os.getenv('DB_HOST'),
-    port=os.getenv('DB_PORT'),
-    user=os.getenv('DB_USER'),
-    password=os.getenv('DB_PASSWORD'),
-    database=os.getenv('DB_NAME')
-)
-cursor = connection.cursor(dictionary=True)
-# Fetch category_id along with other product data
-cursor.execute("SELECT product_id, product_name, product_embedding, category_id FROM products WHERE product_embedding IS NOT NULL")
-products_data = cursor.fetchall()
-cursor.close()
-connection.close()
-
-product_ids = [product['product_id'] for product in products_data]
-product_embeddings = np.array([np.frombuffer(product['product_embedding'], dtype=np.float32) for product in products_data])
-product_id_to_category = {product['product_id']: product['category_id'] for product in products_data}
-product_id_to_name = {product['product_id']: product['product_name'] for product in products_data}
+try:
+    # Prefer the int8-quantized ONNX Runtime encoder, which is much faster on CPU
+    from onnx_encoder import load_onnx_encoder
+    encode = load_onnx_encoder()
+    print("ONNX model loaded.")
+except ImportError as err:
+    # Report the actual error, which may be a version mismatch (e.g. optimum vs. transformers)
+    # rather than a missing package
+    print(f"ONNX encoder unavailable ({err}). Falling back to the PyTorch model.")
+    # Only needed by the fallback. Note that torch is loaded on both paths, since optimum imports it too.
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer('all-MiniLM-L6-v2')
+    # With preload_app, the weights are loaded in the gunicorn master. Moving them into shared memory
+    # keeps a single physical copy across all forked workers instead of one per worker.
+    for param in model.parameters():
+        param.data.share_memory_()
+    encode = model.encode
+    print("Model loaded.")
+
+# Encoding is CPU-bound and would block the gevent hub (and every other in-flight request)
+# for its whole duration, so it is run on a single native worker thread instead.
+# The pool is created lazily so each forked gunicorn worker gets its own.
+encode_pool = None
+
+def create_encode_pool():
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            # Under gevent, threading is patched to greenlets; gevent's executor uses real OS threads
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor(max_workers=1)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=1)
+
+def encode_query(query):
+    global encode_pool
+    if encode_pool is None:
+        encode_pool = create_encode_pool()
+    return encode_pool.submit(encode, query).result()
+
+# Many searches repeat verbatim, so cache the normalized query embeddings.
+# The model's tokenizer is uncased, so lowercased queries are used as the cache key.
+@lru_cache(maxsize=4096)
+def get_query_embedding(normalized_query):
+    query_embedding = np.asarray(encode_query(normalized_query), dtype=np.float32).copy()
+    query_embedding /= (np.linalg.norm(query_embedding) + 1e-12)
+    query_embedding.flags.writeable = False # Cached arrays are shared between requests
+    return query_embedding
+
+# Load the Faiss index and product data, memory-mapped from the on-disk cache when it is up to date
+index, product_ids, product_category_ids, product_names, product_embeddings = load_or_build_index()
+# The DB is not used after startup, so disconnect before gunicorn forks the workers
+close_pool()
+
+# Per-product data below is aligned with the rows of product_embeddings (and so with Faiss indices)
+product_cat_ranks = np.fromiter((PROJECT_CATEGORY_RANK.get(cat_id, UNLISTED_CATEGORY_RANK) for cat_id in product_category_ids.tolist()), dtype=np.int64, count=len(product_category_ids))
+# Precompute lowercased name words and their stems once, since product names don't change per request,
+# storing them as integer ids for the JIT-compiled boosting kernel
+product_name_words = [name.lower().split() for name in product_names]
+(name_vocabulary, stem_to_id, name_word_offsets, name_word_data,
+ name_stem_offsets, name_stem_data) = build_name_token_arrays(product_name_words, stemmer)
+# Products are stored sorted by category, so each category is a contiguous run of rows in product_embeddings.
+# Map each category to its slice, so category-scoped search works on a view instead of copying rows.
+category_values, category_starts, category_counts = np.unique(product_category_ids, return_index=True, return_counts=True)
+category_to_slice = {int(cat_id): slice(int(start), int(start + count)) for cat_id, start, count in zip(category_values, category_starts, category_counts)}
 print(f"{len(product_ids)} products loaded into memory.")
 
-# Initialize Faiss index
-if product_embeddings.size > 0:
-    dimension = product_embeddings.shape[1]  # Dimension of embeddings
-    index = faiss.IndexFlatL2(dimension)  # Using L2 distance for similarity
-    index.add(product_embeddings)  # Add all product embeddings to the index
-    print(f"Faiss index created with {index.ntotal} embeddings.")
+# Partial matches of a query word against every name word, cached since query words repeat often
+@lru_cache(maxsize=4096)
+def get_partial_match_word_ids(query_word):
+    return partial_match_word_ids(query_word, name_vocabulary)
+
+def get_keyword_boosts(query, candidates):
+    query_words = query.lower().split()
+    # Stem each query word once per request instead of once per product
+    query_stem_ids = np.array([stem_to_id.get(stemmer.stem(q_word), -1) for q_word in query_words], dtype=np.int32)
+    query_is_generic = np.array([q_word in GENERIC_WORDS for q_word in query_words], dtype=np.bool_)
+    partial_matches = [get_partial_match_word_ids(q_word) for q_word in query_words]
+    partial_offsets = np.zeros(len(query_words) + 1, dtype=np.int64)
+    partial_offsets[1:] = np.cumsum([len(word_ids) for word_ids in partial_matches])
+    partial_data = np.concatenate(partial_matches) if partial_matches else np.empty(0, dtype=np.int32)
+    return compute_boosts(
+        candidates, name_word_offsets, name_word_data, name_stem_offsets, name_stem_data,
+        query_stem_ids, query_is_generic, partial_offsets, partial_data,
+        KEYWORD_BOOST_EXACT, KEYWORD_BOOST_PARTIAL, KEYWORD_BOOST_GENERIC
+    )
+
+# Compile the boosting kernel once in the master process so forked workers don't pay for it on their first search
+get_keyword_boosts("", np.empty(0, dtype=np.int64))
+
+if index is not None:
+    print(f"Faiss index ready with {index.ntotal} embeddings.")
 else:
     print("No product embeddings found in the database. Search will be disabled.")
-    index = None
 # -----------------------------
 
 @app.route('/search', methods=['POST'])
@@ -97,132 +159,99 @@ def search():
         limit = int(request.json.get('limit', 10))
         offset = (page - 1) * limit
 
-        # Generate embedding for the query
-        query_embedding = model.encode(query)
-
-        # Use Faiss to find the top K nearest neighbors
-        K = 250 # Increased for better diversification
-        # Ensure query_embedding is a 2D numpy array of float32
-        query_embedding_np = np.array([query_embedding]).astype('float32')
-        
-        # Perform Faiss search
-        distances, faiss_indices = index.search(query_embedding_np, K)
-        
-        # faiss_indices contains the indices of the top K products in our original product_embeddings array
-        # distances contains the L2 distances (lower is better)
-        
-        # Filter out invalid indices (Faiss might return -1 if K > index.ntotal)
-        valid_faiss_indices = [idx for idx in faiss_indices[0] if idx != -1]
+        # Generate (or reuse a cached) embedding for the query
+        query_embedding = get_query_embedding(query.strip().lower())
 
-        # Get the actual embeddings for these top K products
-        top_k_embeddings = product_embeddings[valid_faiss_indices]
-        
-        # Re-compute cosine similarity for these top K products to get accurate ranking
-        # util.pytorch_cos_sim expects 2D arrays
-        query_embedding_tensor = torch.from_numpy(query_embedding_np)
-        top_k_embeddings_tensor = torch.from_numpy(top_k_embeddings)
-        
-        top_k_similarities = util.pytorch_cos_sim(query_embedding_tensor, top_k_embeddings_tensor)[0].cpu().numpy()
-        
-        # Map back to product_ids
-        top_k_product_ids = [product_ids[i] for i in valid_faiss_indices]
-        
-        # Create sorted_results from these top K items, sorted by similarity
-        sorted_results = sorted(zip(top_k_product_ids, top_k_similarities), key=lambda x: x[1], reverse=True)
-
-        # --- KEYWORD BOOSTING LOGIC (Additive, Stemmer-based) ---
-        boosted_results = []
-        query_words = query.lower().split()
-        for product_id, similarity in sorted_results:
-            product_name = product_id_to_name.get(product_id, "").lower()
-            product_name_words = product_name.split()
-            
-            total_boost = 0
-            # Iterate through each word in the query
-            for q_word in query_words:
-                # Check for a match in the product name words, and boost only once per query word
-                for p_word in product_name_words:
-                    # 1. Stemmed Match Boost
-                    if stemmer.stem(q_word) == stemmer.stem(p_word):
-                        if q_word in GENERIC_WORDS:
-                            total_boost += KEYWORD_BOOST_GENERIC
-                        else:
-                            total_boost += KEYWORD_BOOST_EXACT
-                        break # Move to the next query word
-                    # 2. Partial Match Boost (as a fallback)
-                    elif q_word in p_word or p_word in q_word:
-                        total_boost += KEYWORD_BOOST_PARTIAL
-                        break # Move to the next query word
-            
-            boosted_results.append((product_id, similarity + total_boost))
-        
-        # Re-sort after applying boosts
-        sorted_results = sorted(boosted_results, key=lambda x: x[1], reverse=True)
-        # --- END KEYWORD BOOSTING LOGIC ---
-        
-        # Filter by category if category_id is provided
+        # Parse the optional category filter
+        cat_id_int = None
         if category_id:
             try:
                 # Ensure category_id is an integer for comparison
                 cat_id_int = int(category_id)
-                sorted_results = [res for res in sorted_results if product_id_to_category.get(res[0]) == cat_id_int]
             except (ValueError, TypeError):
                 # Handle cases where category_id is not a valid integer
                 pass
+
+        K = 250 # Increased for better diversification
+        # Ensure query_embedding is a contiguous 2D numpy array of float32 (already L2-normalized)
+        query_embedding_np = query_embedding[None, :]
+
+        if cat_id_int is not None:
+            # Score only the products in the requested category instead of filtering the global top K
+            category_slice = category_to_slice.get(cat_id_int, slice(0, 0))
+            category_similarities = product_embeddings[category_slice] @ query_embedding
+            if K < len(category_similarities):
+                top_k_local = np.argpartition(-category_similarities, K)[:K]
+            else:
+                top_k_local = np.arange(len(category_similarities))
+            top_k_local = top_k_local[np.argsort(-category_similarities[top_k_local])]
+            valid_faiss_indices = top_k_local + category_slice.start
+            top_k_similarities = category_similarities[top_k_local]
         else:
+            # Use Faiss to find the top K nearest neighbors
+            similarities, faiss_indices = index.search(query_embedding_np, K)
+            
+            # faiss_indices contains the indices of the top K products in our original product_embeddings array
+            # similarities contains the (quantized) cosine similarities (higher is better), already sorted in descending order
+            
+            # Filter out invalid indices (Faiss might return -1 if K > index.ntotal)
+            valid_mask = faiss_indices[0] != -1
+            valid_faiss_indices = faiss_indices[0][valid_mask]
+            top_k_similarities = similarities[0][valid_mask]
+        
+        # --- KEYWORD BOOSTING LOGIC (Additive, Stemmer-based) ---
+        boosts = get_keyword_boosts(query, valid_faiss_indices)
+        
+        # Re-sort after applying boosts (stable, so ties keep their similarity order)
+        boosted_similarities = top_k_similarities + boosts
+        result_indices = valid_faiss_indices[np.argsort(-boosted_similarities, kind='stable')]
+        # --- END KEYWORD BOOSTING LOGIC ---
+        
+        # Results are already restricted to the category when category_id is provided,
+        # so diversification only applies to unfiltered searches
+        if not category_id:
             # --- CONDITIONAL & REFINED DIVERSIFICATION LOGIC ---
             is_project_query = any(keyword in query.lower() for keyword in PROJECT_KEYWORDS)
             
             if is_project_query:
                 print("Project-based query detected. Applying category-based ordering with limits.")
                 
-                # Bucket all results by their category ID
-                results_by_category = {}
-                for pid, sim in sorted_results:
-                    cat_id = product_id_to_category.get(pid)
-                    if cat_id not in results_by_category:
-                        results_by_category[cat_id] = []
-                    results_by_category[cat_id].append((pid, sim))
-
-                top_results = []
-                seen_product_ids = set()
-                
-                # 1. Add the top N items from each ordered category group for the preview
-                for category_group in PROJECT_CATEGORY_ORDER:
-                    for category_id in category_group:
-                        products_in_cat = results_by_category.get(category_id, [])
-                        # Take the top N items
-                        for i, (product_id, similarity) in enumerate(products_in_cat):
-                            if i < MAX_ITEMS_PER_CATEGORY:
-                                if product_id not in seen_product_ids:
-                                    top_results.append((product_id, similarity))
-                                    seen_product_ids.add(product_id)
-
-                # 2. Add all remaining products, preserving the original semantic sort order
-                remaining_products = []
-                for product_id, similarity in sorted_results:
-                    if product_id not in seen_product_ids:
-                        remaining_products.append((product_id, similarity))
-                
+                # Category rank of every result, in the current (score-sorted) order
+                num_results = len(result_indices)
+                cat_ranks = product_cat_ranks[result_indices]
+
+                # Position of each result within its category: a stable sort groups results by category
+                # while preserving score order, and each group's start offset is subtracted
+                by_category = np.argsort(cat_ranks, kind='stable')
+                grouped_ranks = cat_ranks[by_category]
+                position_in_category = np.empty(num_results, dtype=np.int64)
+                position_in_category[by_category] = np.arange(num_results) - np.searchsorted(grouped_ranks, grouped_ranks, side='left')
+
+                # 1. The top N items from each ordered category for the preview, in category order
+                preview_mask = (cat_ranks < UNLISTED_CATEGORY_RANK) & (position_in_category < MAX_ITEMS_PER_CATEGORY)
+                preview = np.flatnonzero(preview_mask)
+                preview = preview[np.argsort(cat_ranks[preview], kind='stable')]
+
+                # 2. All remaining products, preserving the original semantic sort order
+                remaining = np.flatnonzero(~preview_mask)
+
                 # Combine the lists: the curated top results first, followed by all other relevant products
-                sorted_results = top_results + remaining_products
+                result_indices = result_indices[np.concatenate([preview, remaining])]
             else:
                 print("Specific query detected. Skipping diversification.")
             # --- END DIVERSIFICATION LOGIC ---
 
-        total_results = len(sorted_results)
-
-        # Paginate results
-        paginated_results = sorted_results[offset : offset + limit]
+        total_results = len(result_indices)
 
-        # Get IDs for the current page
-        paginated_ids = [int(product_id) for product_id, similarity in paginated_results]
+        # Paginate results and get the IDs for the current page in a single gather
+        paginated_ids = product_ids[result_indices[offset : offset + limit]].tolist()
         
         print(f"Sending {len(paginated_ids)} results for query: '{query}'")
-        return jsonify({
+        # Serialize with orjson, which is much faster than the stdlib json used by jsonify
+        return Response(orjson.dumps({
             "product_ids": paginated_ids,
             "total": total_results
-        })
+        }), mimetype='application/json')
     except Exception as e:
         print(f"[ERROR] An error occurred during search: {e}")
         return jsonify({"error": "An internal error occurred in the search service"}), 500